@@ -5,14 +5,93 @@ Outputs format: <name> <dim> (height x width)
 """
 
 import os
+import struct
 from pathlib import Path
 from PIL import Image
 
 # Target directory
 PICTURES_DIR = Path("assets/pictures")
 
-# Supported image formats
-IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff", ".JPG", ".JPEG", ".PNG"}
+# Supported image formats (matched against the lowercased suffix)
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff"}
+
+
+# JPEG start-of-frame markers (SOF0-SOF15, excluding DHT, JPG and DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _peek_jpeg_dims(f):
+    """Scan JPEG segments for the first SOF marker and read its dimensions."""
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ValueError("JPEG frame header not found")
+        # Skip fill bytes between markers
+        while marker[1] == 0xFF:
+            fill = f.read(1)
+            if not fill:
+                raise ValueError("JPEG frame header not found")
+            marker = marker[1:] + fill
+        if marker[1] in JPEG_SOF_MARKERS:
+            _, _, height, width = struct.unpack(">HBHH", f.read(7))
+            return width, height
+        (segment_length,) = struct.unpack(">H", f.read(2))
+        f.seek(segment_length - 2, 1)
+
+
+def _peek_dims(path):
+    """
+    Read (width, height) from the PNG, JPEG or WebP header without decoding.
+    Raises ValueError for other formats.
+    """
+    with open(path, "rb") as f:
+        header = f.read(32)
+
+        if header.startswith(b"\x89PNG\r\n\x1a\n"):
+            return struct.unpack(">II", header[16:24])
+
+        if header.startswith(b"\xff\xd8"):
+            return _peek_jpeg_dims(f)
+
+        if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+            chunk = header[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", header[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                (bits,) = struct.unpack("<I", header[21:25])
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                width = int.from_bytes(header[24:27], "little") + 1
+                height = int.from_bytes(header[27:30], "little") + 1
+                return width, height
+
+    raise ValueError("unsupported header")
+
+
+def list_images(directory):
+    """Return the image files directly inside directory, sorted by filename."""
+    # scandir supplies the file type without extra stats
+    with os.scandir(directory) as entries:
+        image_files = [
+            Path(entry.path) for entry in entries
+            if entry.is_file(follow_symlinks=False)
+            and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS
+        ]
+
+    image_files.sort(key=lambda x: x.name)
+    return image_files
+
+
+def read_dims(img_path):
+    """Return (width, height), from the header when possible, else via Pillow."""
+    try:
+        return _peek_dims(img_path)
+    except (ValueError, struct.error):
+        # Fall back to Pillow for other formats or unusual headers
+        with Image.open(img_path) as img:
+            return img.size
 
 
 def analyze_images():
@@ -21,22 +100,14 @@ def analyze_images():
         print(f"Error: Directory '{PICTURES_DIR}' not found.")
         return
 
-    # Get all image files
-    image_files = [
-        f for f in PICTURES_DIR.iterdir()
-        if f.is_file() and f.suffix in IMAGE_EXTENSIONS
-    ]
-
-    # Sort by filename
-    image_files.sort(key=lambda x: x.name)
+    image_files = list_images(PICTURES_DIR)
 
     print(f"Found {len(image_files)} images in '{PICTURES_DIR}':\n")
 
     for img_path in image_files:
         try:
-            with Image.open(img_path) as img:
-                width, height = img.size
-                print(f"{img_path.name} {height}x{width}")
+            width, height = read_dims(img_path)
+            print(f"{img_path.name} {height}x{width}")
         except Exception as e:
             print(f"{img_path.name} ERROR: {e}")
 
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Build all derived site assets in one pass.
+Generates thumbnails and placeholders, reports image dimensions in the
+analyze_images.py format, and precompresses styles and scripts. Each source
+image is decoded at most once: dimensions come from the thumbnail workers,
+or from the file header for images whose thumbnails were already fresh.
+"""
+
+from analyze_images import list_images, read_dims
+from generate_thumbnails import SOURCE_DIR, generate_thumbnails
+from precompress import precompress
+
+
+def build_assets():
+    """Generate thumbnails, print image dimensions and precompress text assets."""
+    if not SOURCE_DIR.exists():
+        print(f"Error: Source directory '{SOURCE_DIR}' not found.")
+        return
+
+    results = generate_thumbnails()
+    decoded_dims = {r["name"]: r["original_dim"] for r in results}
+
+    image_files = list_images(SOURCE_DIR)
+    print(f"\nDimensions of {len(image_files)} images in '{SOURCE_DIR}':\n")
+
+    for img_path in image_files:
+        dim = decoded_dims.get(img_path.name)
+        if dim is None:
+            try:
+                width, height = read_dims(img_path)
+                dim = f"{height}x{width}"
+            except Exception as e:
+                print(f"{img_path.name} ERROR: {e}")
+                continue
+        print(f"{img_path.name} {dim}")
+
+    print()
+    precompress()
+
+
+if __name__ == "__main__":
+    build_assets()
@@ -4,9 +4,36 @@ Generate thumbnails from assets/pictures to assets/thumbnails.
 Compresses images to ~0.25MB at 1/4x resolution (1/16x total downsampling).
 """
 
+import base64
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
 from pathlib import Path
-from PIL import Image
+from PIL import Image, ImageCms
+
+from analyze_images import IMAGE_EXTENSIONS, list_images, read_dims
+from placeholders import (
+    PLACEHOLDER_PAGES,
+    image_to_thumbhash,
+    inject_placeholders,
+    inject_srcset,
+)
+
+try:
+    # Registers the AVIF codec on Pillow builds without native support
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+try:
+    # Optional: faster shrink-on-load and resize through libvips. The process
+    # pool already runs one image per core, so limit libvips to one thread per
+    # process; the variable is read when libvips initializes on import
+    os.environ.setdefault("VIPS_CONCURRENCY", "1")
+    import pyvips
+except ImportError:
+    pyvips = None
 
 # Source and destination directories
 SOURCE_DIR = Path("assets/pictures")
@@ -15,115 +42,412 @@ OUTPUT_DIR = Path("assets/thumbnails")
 # Target settings
 TARGET_SIZE_BYTES = 250 * 1024  # ~0.25MB
 SCALE_FACTOR = 0.25  # 1/4x on each dimension
-QUALITY_START = 85  # Initial JPEG quality
-QUALITY_STEP = 5  # Quality decrement step
-
-# Supported image formats
-IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp", ".tiff", ".JPG", ".JPEG", ".PNG"}
-
-
-def resize_with_aspect_ratio(img, scale_factor):
-    """Resize image maintaining aspect ratio."""
-    new_width = int(img.width * scale_factor)
-    new_height = int(img.height * scale_factor)
+QUALITY_MIN = 10  # Lowest JPEG quality to search
+QUALITY_MAX = 95  # Highest JPEG quality to search
+TARGET_TOLERANCE = 0.975  # Accept any size within 2.5% under the target
+QUALITY_DEFAULT = 85  # Quality used when the size estimate skips the search
+BYTES_PER_PIXEL_ESTIMATE = 0.25  # Typical JPEG size per pixel at the default quality
+ESTIMATE_MARGIN = 1.5  # Safety factor applied to the size estimate
+
+# Responsive srcset widths, generated from the same decode as the thumbnail;
+# each gets the target size scaled by its area relative to SRCSET_BASE_WIDTH
+SRCSET_WIDTHS = (320, 640, 1280)
+SRCSET_BASE_WIDTH = 1280
+
+# Perceptually tuned quantization table (N. Robidoux's, as shipped in mozjpeg),
+# used for both luma and chroma. Pillow scales it by the requested quality.
+PERCEPTUAL_QTABLE = [
+    16, 16, 16, 18, 25, 37, 56, 85,
+    16, 17, 20, 27, 34, 40, 53, 75,
+    16, 20, 24, 31, 43, 62, 91, 135,
+    18, 27, 31, 40, 53, 74, 106, 156,
+    25, 34, 43, 53, 69, 94, 131, 189,
+    37, 40, 62, 74, 94, 124, 169, 238,
+    56, 53, 91, 106, 131, 169, 226, 311,
+    85, 75, 135, 156, 189, 238, 311, 418,
+]
+
+# Drop camera metadata (EXIF previews, GPS, maker notes, ICC, XMP) from output;
+# pixels are converted to sRGB first so dropping the ICC profile is lossless
+STRIP_METADATA = {"exif": b"", "icc_profile": None, "xmp": b""}
+
+# Encoder options shared by every JPEG trial
+JPEG_SAVE_OPTIONS = {
+    **STRIP_METADATA,
+    "optimize": True,
+    "progressive": True,
+    "subsampling": 2,  # 4:2:0
+    "qtables": [PERCEPTUAL_QTABLE, PERCEPTUAL_QTABLE],
+}
+
+# Smaller formats emitted next to each JPEG thumbnail, served to browsers that
+# accept them: suffix -> (Pillow format, max quality, encoder options)
+ALTERNATE_FORMATS = {
+    ".webp": ("WEBP", 85, {"method": 6, **STRIP_METADATA}),
+}
+if ".avif" in Image.registered_extensions():
+    ALTERNATE_FORMATS[".avif"] = ("AVIF", 70, {"speed": 6, **STRIP_METADATA})
+
+# Recorded in each .meta sidecar; bump it when the set of outputs or how they
+# are encoded changes, so existing thumbnails are regenerated
+PIPELINE_VERSION = 3
+
+
+def resize_with_aspect_ratio(img, scale_factor, original_size=None):
+    """
+    Resize image maintaining aspect ratio.
+    original_size is the full-resolution size when img was decoded as a draft.
+    """
+    width, height = original_size or img.size
+    new_width = int(width * scale_factor)
+    new_height = int(height * scale_factor)
     return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
 
 
-def compress_to_target_size(img, target_bytes, initial_quality, quality_step):
+def compress_to_target_size(
+    img,
+    target_bytes,
+    min_quality,
+    max_quality,
+    format="JPEG",
+    save_options=None,
+    try_max_first=False,
+):
     """
-    Compress image to approximately target size by adjusting JPEG quality.
+    Compress image to approximately target size by adjusting encoder quality.
+    Binary-searches for the highest quality whose output fits the target.
+    With try_max_first, encodes once at max_quality and only searches if that
+    overflows, for formats whose quality cap almost always fits.
     Returns the bytes of the compressed image.
     """
-    quality = initial_quality
+    if save_options is None:
+        save_options = JPEG_SAVE_OPTIONS
 
-    while quality > 10:  # Don't go below quality 10
-        from io import BytesIO
+    # Reuse two buffers across trials: the current trial and the best fit so far
+    output, best = BytesIO(), BytesIO()
+    found = False
+    low, high = min_quality, max_quality
 
-        output = BytesIO()
-        img.save(output, format="JPEG", quality=quality, optimize=True)
+    if try_max_first:
+        img.save(output, format=format, quality=max_quality, **save_options)
+        if output.tell() <= target_bytes:
+            return output.getvalue()
+        high = max_quality - 1
+
+    while low <= high:
+        quality = (low + high) // 2
+        output.seek(0)
+        output.truncate(0)
+        img.save(output, format=format, quality=quality, **save_options)
         size = output.tell()
 
         if size <= target_bytes:
-            return output.getvalue()
+            output, best = best, output
+            found = True
+            # Close enough to the target, no need to keep searching
+            if size >= target_bytes * TARGET_TOLERANCE:
+                break
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    if not found:
+        # Nothing fit, so the search's last trial was already at min_quality
+        return output.getvalue()
+
+    return best.getvalue()
+
+
+def _convert_to_srgb(img, icc_profile):
+    """
+    Convert an RGB image tagged with icc_profile (e.g. Display P3) to sRGB,
+    so it renders the same once the profile is stripped from the output.
+    """
+    if not icc_profile or img.mode != "RGB":
+        return img
+    try:
+        return ImageCms.profileToProfile(
+            img,
+            ImageCms.ImageCmsProfile(BytesIO(icc_profile)),
+            ImageCms.createProfile("sRGB"),
+            outputMode="RGB",
+        )
+    except ImageCms.PyCMSError:
+        # Unreadable profile: keep the pixels as they are
+        return img
+
+
+def _load_with_pyvips(img_path):
+    """Shrink-on-load with libvips, returning (full size, resized Pillow image)."""
+    full_size = read_dims(img_path)
+    new_width = int(full_size[0] * SCALE_FACTOR)
+    new_height = int(full_size[1] * SCALE_FACTOR)
+
+    # thumbnail() opens the file itself so JPEGs get a DCT-scaled decode
+    thumb = pyvips.Image.thumbnail(
+        str(img_path),
+        new_width,
+        height=new_height,
+        size="down",
+        no_rotate=True,
+        export_profile="srgb",
+    )
+
+    # Match the Pillow path: 8-bit RGB or greyscale without alpha
+    if thumb.hasalpha():
+        thumb = thumb.flatten()
+    if thumb.bands not in (1, 3):
+        thumb = thumb.colourspace("srgb")
+    thumb = thumb.cast("uchar")
+
+    # Materialize the thumbnail as a Pillow image for the encoders
+    mode = "L" if thumb.bands == 1 else "RGB"
+    resized = Image.frombytes(mode, (thumb.width, thumb.height), thumb.write_to_memory())
+    return full_size, resized
+
+
+def _load_with_pillow(img_path):
+    """Decode and LANCZOS-resize with Pillow, returning (full size, resized image)."""
+    with Image.open(img_path) as img:
+        full_size = img.size
+        icc_profile = img.info.get("icc_profile")
+
+        # Let libjpeg decode at a reduced DCT scale (no-op for non-JPEG),
+        # keeping at least 2x the target resolution for the LANCZOS pass
+        target_width = int(img.width * SCALE_FACTOR)
+        target_height = int(img.height * SCALE_FACTOR)
+        img.draft("RGB", (target_width * 2, target_height * 2))
+
+        # Convert to RGB if necessary (for JPEG output)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        # Resize to 1/4x dimensions, then bring wide-gamut sources into sRGB
+        resized = resize_with_aspect_ratio(img, SCALE_FACTOR, full_size)
+        return full_size, _convert_to_srgb(resized, icc_profile)
+
+
+def load_thumbnail_image(img_path):
+    """
+    Load img_path downscaled by SCALE_FACTOR.
+    Uses libvips when available, falling back to Pillow.
+    Returns (full-resolution size, resized Pillow image).
+    """
+    if pyvips is not None:
+        return _load_with_pyvips(img_path)
+    return _load_with_pillow(img_path)
+
+
+def _source_area(img_path):
+    """Sort key of (pixel count, dimensions), read from the file header."""
+    try:
+        width, height = read_dims(img_path)
+    except Exception:
+        return 0, (0, 0)
+    return width * height, (width, height)
+
+
+def _read_source_stamp(src):
+    """Return the (mtime_ns, size) stamp recorded for a source file."""
+    stat = src.stat()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _is_fresh(src, dst):
+    """
+    Check whether dst was generated from the current version of src by the
+    current pipeline, and every output recorded alongside it still exists.
+    """
+    meta_path = dst.with_suffix(".jpg.meta")
+    if not dst.exists() or not meta_path.exists():
+        return False
+
+    try:
+        recorded = json.loads(meta_path.read_text())
+    except (OSError, ValueError):
+        return False
+
+    if not isinstance(recorded, dict) or recorded.get("version") != PIPELINE_VERSION:
+        return False
+    if recorded.get("formats") != sorted(ALTERNATE_FORMATS):
+        return False
+    if recorded.get("source") != _read_source_stamp(src):
+        return False
+    return all((dst.parent / name).exists() for name in recorded.get("outputs", []))
+
+
+def _write_atomic(path, data):
+    """
+    Write data to path through a temp file in the same directory, so the
+    server never serves a partially written output while it is replaced.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
 
-        quality -= quality_step
 
-    # If we couldn't get under target size, return lowest quality
-    return output.getvalue()
+def _write_alternates(img, jpeg_path, jpeg_size, target_bytes):
+    """
+    Write the ALTERNATE_FORMATS siblings of jpeg_path for content negotiation,
+    keeping only those smaller than the JPEG. Returns the names written.
+    """
+    written = []
+    for suffix, (format, max_quality, save_options) in ALTERNATE_FORMATS.items():
+        # The quality caps nearly always fit, so encode at the cap before
+        # falling back to a search
+        alternate_data = compress_to_target_size(
+            img, target_bytes, QUALITY_MIN, max_quality, format, save_options,
+            try_max_first=True,
+        )
+        alternate_path = jpeg_path.with_suffix(suffix)
+        if len(alternate_data) < jpeg_size:
+            _write_atomic(alternate_path, alternate_data)
+            written.append(alternate_path.name)
+        elif alternate_path.exists():
+            alternate_path.unlink()
+    return written
+
+
+def _process_one(img_path):
+    """
+    Generate the thumbnail for a single image and write it to OUTPUT_DIR.
+    Runs in a worker process; returns only the stats needed for reporting.
+    """
+    original_size = img_path.stat().st_size
+    full_size, resized = load_thumbnail_image(img_path)
+    original_dim = f"{full_size[1]}x{full_size[0]}"
+    new_dim = f"{resized.height}x{resized.width}"
+
+    # Compress to target size, skipping the search when the image is small
+    # enough to fit comfortably at the default quality
+    estimated_size = resized.width * resized.height * BYTES_PER_PIXEL_ESTIMATE
+    if estimated_size * ESTIMATE_MARGIN < TARGET_SIZE_BYTES:
+        output = BytesIO()
+        resized.save(output, format="JPEG", quality=QUALITY_DEFAULT, **JPEG_SAVE_OPTIONS)
+        thumbnail_data = output.getvalue()
+    else:
+        thumbnail_data = compress_to_target_size(
+            resized, TARGET_SIZE_BYTES, QUALITY_MIN, QUALITY_MAX
+        )
+    final_size = len(thumbnail_data)
+
+    # Save thumbnail (written here so the bytes never cross the process boundary)
+    output_path = OUTPUT_DIR / f"{img_path.stem}.jpg"
+    _write_atomic(output_path, thumbnail_data)
+    outputs = [output_path.name]
+
+    outputs += _write_alternates(resized, output_path, final_size, TARGET_SIZE_BYTES)
+
+    # Save smaller width variants for srcset, never upscaling, each with its
+    # own alternates since browsers request the variants directly
+    for width in SRCSET_WIDTHS:
+        if width >= resized.width:
+            continue
+        height = round(resized.height * width / resized.width)
+        variant = resized.resize((width, height), Image.Resampling.LANCZOS)
+        variant_target = int(TARGET_SIZE_BYTES * (width / SRCSET_BASE_WIDTH) ** 2)
+        variant_data = compress_to_target_size(
+            variant, variant_target, QUALITY_MIN, QUALITY_MAX
+        )
+        variant_path = OUTPUT_DIR / f"{img_path.stem}-{width}w.jpg"
+        _write_atomic(variant_path, variant_data)
+        outputs.append(variant_path.name)
+        outputs += _write_alternates(variant, variant_path, len(variant_data), variant_target)
+
+    # Save the ThumbHash placeholder as base64 text
+    thumbhash = image_to_thumbhash(resized)
+    thumbhash_path = output_path.with_suffix(".thumbhash")
+    _write_atomic(thumbhash_path, base64.b64encode(thumbhash))
+    outputs.append(thumbhash_path.name)
+
+    # Record the source stamp, pipeline version and outputs so unchanged
+    # images are skipped next run
+    meta = {
+        "version": PIPELINE_VERSION,
+        "formats": sorted(ALTERNATE_FORMATS),
+        "source": _read_source_stamp(img_path),
+        "outputs": outputs,
+    }
+    _write_atomic(output_path.with_suffix(".jpg.meta"), json.dumps(meta).encode())
+
+    return {
+        "name": img_path.name,
+        "original_dim": original_dim,
+        "new_dim": new_dim,
+        "original_size": original_size,
+        "final_size": final_size,
+        "compression_ratio": original_size / final_size,
+    }
+
+
+def update_pages():
+    """Inline the placeholders and srcsets from OUTPUT_DIR into the gallery pages."""
+    for page in PLACEHOLDER_PAGES:
+        if page.exists():
+            inject_placeholders(page, OUTPUT_DIR)
+            inject_srcset(page, OUTPUT_DIR)
 
 
 def generate_thumbnails():
-    """Generate thumbnails for all images in source directory."""
+    """
+    Generate thumbnails for all images in source directory.
+    Returns the stats of the images processed in this run.
+    """
     if not SOURCE_DIR.exists():
         print(f"Error: Source directory '{SOURCE_DIR}' not found.")
-        return
+        return []
 
     # Create output directory
     OUTPUT_DIR.mkdir(exist_ok=True)
 
-    # Get all image files
-    image_files = [
-        f for f in SOURCE_DIR.iterdir()
-        if f.is_file() and f.suffix in IMAGE_EXTENSIONS
-    ]
-
-    # Sort by filename
-    image_files.sort(key=lambda x: x.name)
+    # Get all image files, sorted by filename
+    image_files = list_images(SOURCE_DIR)
 
     print(f"Found {len(image_files)} images in '{SOURCE_DIR}'")
     print(f"Generating thumbnails at {SCALE_FACTOR}x resolution ({SCALE_FACTOR**2:.2%} area)...")
     print(f"Target size: ~{TARGET_SIZE_BYTES / 1024:.1f}KB per image\n")
 
+    # Skip images whose thumbnail is already up to date
+    pending = [
+        img_path for img_path in image_files
+        if not _is_fresh(img_path, OUTPUT_DIR / f"{img_path.stem}.jpg")
+    ]
+    skipped = len(image_files) - len(pending)
+
+    # Submit largest sources first so the longest jobs start early instead of
+    # straggling at the tail of the pool
+    pending.sort(key=_source_area, reverse=True)
+    if skipped:
+        print(f"Skipping {skipped} unchanged images\n")
+
     results = []
 
-    for img_path in image_files:
-        try:
-            # Open image
-            with Image.open(img_path) as img:
-                original_size = img_path.stat().st_size
-                original_dim = f"{img.height}x{img.width}"
-
-                # Convert to RGB if necessary (for JPEG output)
-                if img.mode not in ("RGB", "L"):
-                    img = img.convert("RGB")
-
-                # Resize to 1/4x dimensions
-                resized = resize_with_aspect_ratio(img, SCALE_FACTOR)
-                new_dim = f"{resized.height}x{resized.width}"
-
-                # Compress to target size
-                thumbnail_data = compress_to_target_size(
-                    resized, TARGET_SIZE_BYTES, QUALITY_START, QUALITY_STEP
-                )
-                final_size = len(thumbnail_data)
-
-                # Save thumbnail
-                output_path = OUTPUT_DIR / f"{img_path.stem}.jpg"
-                with open(output_path, "wb") as f:
-                    f.write(thumbnail_data)
-
-                # Calculate stats
-                compression_ratio = original_size / final_size
-                size_reduction = (1 - final_size / original_size) * 100
-
-                results.append({
-                    "name": img_path.name,
-                    "original_dim": original_dim,
-                    "new_dim": new_dim,
-                    "original_size": original_size,
-                    "final_size": final_size,
-                    "compression_ratio": compression_ratio,
-                })
-
-                # Print result
-                print(
-                    f"✓ {img_path.name:30s} {original_dim:>9s} → {new_dim:>9s} | "
-                    f"{original_size / 1024:6.1f}KB → {final_size / 1024:5.1f}KB "
-                    f"({compression_ratio:.1f}x smaller, {size_reduction:.0f}% reduced)"
-                )
-
-        except Exception as e:
-            print(f"✗ {img_path.name}: ERROR - {e}")
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        futures = {
+            executor.submit(_process_one, img_path): img_path
+            for img_path in pending
+        }
+
+        for future in as_completed(futures):
+            img_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"✗ {img_path.name}: ERROR - {e}")
+                continue
+
+            results.append(result)
+
+            # Print result
+            size_reduction = (1 - result["final_size"] / result["original_size"]) * 100
+            print(
+                f"✓ {result['name']:30s} {result['original_dim']:>9s} → {result['new_dim']:>9s} | "
+                f"{result['original_size'] / 1024:6.1f}KB → {result['final_size'] / 1024:5.1f}KB "
+                f"({result['compression_ratio']:.1f}x smaller, {size_reduction:.0f}% reduced)"
+            )
+
+    update_pages()
 
     # Print summary
     print(f"\n{'='*90}")
@@ -139,6 +463,8 @@ def generate_thumbnails():
         print(f"Average compression: {avg_compression:.1f}x smaller")
         print(f"Space saved: {(1 - total_final / total_original) * 100:.0f}%")
 
+    return results
+
 
 if __name__ == "__main__":
     generate_thumbnails()
@@ -1,54 +1,283 @@
-from fastapi import FastAPI
+import asyncio
+import multiprocessing
+import os
+import secrets
+import stat
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import anyio.to_thread
+from fastapi import FastAPI, Header, HTTPException
 from fastapi.responses import FileResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.staticfiles import NotModifiedResponse
+
+from analyze_images import IMAGE_EXTENSIONS
+from generate_thumbnails import OUTPUT_DIR, SOURCE_DIR, _process_one, update_pages
+
+PATH_CACHE_SIZE = 2048
+PATH_CACHE_TTL = 5  # seconds before a cached path resolution is refreshed
+
+# Worker processes for on-demand thumbnail regeneration (one image per call)
+ADMIN_WORKERS = 2
+
+# Bearer token for the /admin endpoints; they are disabled when unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Content types for the assets this site serves, so responses skip the
+# mimetypes lookup; anything else falls back to FileResponse's guess
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".avif": "image/avif",
+    ".svg": "image/svg+xml",
+    ".ico": "image/x-icon",
+    ".css": "text/css",
+    ".js": "text/javascript",
+    ".mjs": "text/javascript",
+    ".json": "application/json",
+    ".map": "application/json",
+    ".pdf": "application/pdf",
+    ".html": "text/html",
+    ".txt": "text/plain",
+}
+
+
+def media_type_for(path):
+    """Return the content type for path from MEDIA_TYPES, or None if unknown."""
+    return MEDIA_TYPES.get(os.path.splitext(path)[1].lower())
+
+
+def parse_qvalues(header):
+    """Map each token of an Accept-style header to its q-value (default 1)."""
+    qvalues = {}
+    for item in header.split(","):
+        token, *params = item.split(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[token] = q
+    return qvalues
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles that briefly caches path resolution. Files are still stat'ed
+    on every request so headers always match what is on disk.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._cached_resolve = lru_cache(maxsize=PATH_CACHE_SIZE)(self._resolve_path)
+
+    def _resolve_path(self, path, ttl_bucket):
+        """Return the candidate full paths for path inside the served directories."""
+        # Reject absolute paths so they cannot escape the served directory
+        if path.startswith(("/", "\\")):
+            return ()
+
+        candidates = []
+        for directory in self.all_directories:
+            joined_path = os.path.join(directory, path)
+            if self.follow_symlink:
+                full_path = os.path.abspath(joined_path)
+                directory = os.path.abspath(directory)
+            else:
+                full_path = os.path.realpath(joined_path)
+                directory = os.path.realpath(directory)
+            # Don't allow misbehaving clients to break out of the directory
+            if os.path.commonpath([full_path, directory]) == str(directory):
+                candidates.append(full_path)
+        return tuple(candidates)
+
+    def lookup_path(self, path):
+        # Keying on the TTL bucket lets stale resolutions age out of the LRU
+        bucket = int(time.monotonic() // PATH_CACHE_TTL)
+        for full_path in self._cached_resolve(path, bucket):
+            try:
+                return full_path, os.stat(full_path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return "", None
+
+    def clear_lookup_cache(self):
+        """Drop cached path resolutions, e.g. after the server writes files."""
+        self._cached_resolve.cache_clear()
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            stat_result=stat_result,
+            media_type=media_type_for(full_path),
+        )
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    async def lookup_file(self, path):
+        """Return (full_path, stat_result) if path is a regular file, else None."""
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        if stat_result and stat.S_ISREG(stat_result.st_mode):
+            return full_path, stat_result
+        return None
+
+
+class ThumbnailStaticFiles(CachedStaticFiles):
+    """Serves the AVIF or WebP sibling of a JPEG thumbnail when accepted."""
+
+    ALTERNATE_FORMATS = ((".avif", "image/avif"), (".webp", "image/webp"))
+
+    async def get_response(self, path, scope):
+        root, ext = os.path.splitext(path)
+        if scope["method"] in ("GET", "HEAD") and ext.lower() == ".jpg":
+            # Only formats the client lists explicitly with q > 0; wildcards
+            # like */* don't mean the browser can decode AVIF
+            accepted = parse_qvalues(Headers(scope=scope).get("accept", ""))
+            for suffix, media_type in self.ALTERNATE_FORMATS:
+                if accepted.get(media_type, 0) <= 0:
+                    continue
+                found = await self.lookup_file(root + suffix)
+                if found:
+                    response = self.file_response(*found, scope)
+                    response.headers["Vary"] = "Accept"
+                    return response
+
+        response = await super().get_response(path, scope)
+        response.headers["Vary"] = "Accept"
+        return response
+
+
+class PrecompressedStaticFiles(CachedStaticFiles):
+    """Serves the .br or .gz sibling written by precompress.py when accepted."""
+
+    ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+    async def get_response(self, path, scope):
+        if scope["method"] in ("GET", "HEAD"):
+            request_headers = Headers(scope=scope)
+            accepted = parse_qvalues(request_headers.get("accept-encoding", ""))
+            # The source must exist; a sibling older than it is a stale build
+            source = await self.lookup_file(path)
+            for encoding, suffix in self.ENCODINGS:
+                if source is None or accepted.get(encoding, 0) <= 0:
+                    continue
+                found = await self.lookup_file(path + suffix)
+                if found and found[1].st_mtime_ns >= source[1].st_mtime_ns:
+                    full_path, stat_result = found
+                    response = FileResponse(
+                        full_path,
+                        stat_result=stat_result,
+                        media_type=media_type_for(path) or "text/plain",
+                        headers={"Content-Encoding": encoding, "Vary": "Accept-Encoding"},
+                    )
+                    if self.is_not_modified(response.headers, request_headers):
+                        return NotModifiedResponse(response.headers)
+                    return response
+
+        response = await super().get_response(path, scope)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+# Worker processes for CPU-bound image work, kept off the event loop. The
+# server is multi-threaded, so workers come from a forkserver rather than a
+# fork of this process, and are only started when first needed
+_pool = ProcessPoolExecutor(
+    max_workers=ADMIN_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+)
+
+# Serializes page rewrites when several regenerations finish together
+_pages_lock = asyncio.Lock()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    _pool.shutdown()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
+# Kept so the admin endpoint can drop its lookup cache after writing files
+thumbnail_files = ThumbnailStaticFiles(directory="assets/thumbnails")
 
-@app.get("/scripts/{filename}")
-async def serve_scripts(filename: str):
-    return FileResponse(f"scripts/{filename}")
+app.mount("/scripts", PrecompressedStaticFiles(directory="scripts"), name="scripts")
+app.mount("/assets/pictures", CachedStaticFiles(directory="assets/pictures"), name="pictures")
+app.mount("/assets/pdf", CachedStaticFiles(directory="assets/pdf"), name="pdf")
+app.mount("/assets/thumbnails", thumbnail_files, name="thumbnails")
+app.mount("/styles", PrecompressedStaticFiles(directory="styles"), name="styles")
 
 
-@app.get("/assets/pictures/{filename}")
-async def serve_assets(filename: str):
-    return FileResponse(f"assets/pictures/{filename}")
+def check_admin_token(authorization):
+    """Raise unless authorization carries ADMIN_TOKEN as a bearer token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
 
+    expected = f"Bearer {ADMIN_TOKEN}".encode()
+    if not authorization or not secrets.compare_digest(authorization.encode(), expected):
+        raise HTTPException(status_code=401, headers={"WWW-Authenticate": "Bearer"})
 
-@app.get("/assets/pdf/{filename}")
-async def serve_pdf(filename: str):
-    return FileResponse(f"assets/pdf/{filename}")
 
+@app.post("/admin/thumbnail/{name}")
+async def regenerate_thumbnail(name: str, authorization: str | None = Header(default=None)):
+    check_admin_token(authorization)
 
-@app.get("/assets/thumbnails/{filename}")
-async def serve_thumbnails(filename: str):
-    return FileResponse(f"assets/thumbnails/{filename}")
+    source = SOURCE_DIR / name
+    if source.suffix.lower() not in IMAGE_EXTENSIONS or not source.is_file():
+        raise HTTPException(status_code=404)
 
+    OUTPUT_DIR.mkdir(exist_ok=True)
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(_pool, _process_one, source)
+    except (OSError, ValueError) as e:
+        # Unreadable or corrupt source image
+        raise HTTPException(status_code=422, detail=f"Could not process {name}: {e}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Thumbnail generation failed: {e}")
 
-@app.get("/styles/{filename}")
-async def serve_styles(filename: str):
-    return FileResponse(f"styles/{filename}")
+    # New outputs may appear or disappear, and the pages embed the placeholder
+    thumbnail_files.clear_lookup_cache()
+    async with _pages_lock:
+        await loop.run_in_executor(None, update_pages)
+    return result
 
 
 @app.get("/")
 async def serve_index():
-    return FileResponse("views/index.html")
+    return FileResponse("views/index.html", media_type="text/html")
 
 
 @app.get("/essays")
 async def serve_essays():
-    return FileResponse("views/essays.html")
+    return FileResponse("views/essays.html", media_type="text/html")
 
 
 @app.get("/photography")
 async def serve_photography():
-    return FileResponse("views/photography.html")
+    return FileResponse("views/photography.html", media_type="text/html")
 
 
 @app.get("/videos")
 async def serve_videos():
-    return FileResponse("views/videos.html")
+    return FileResponse("views/videos.html", media_type="text/html")
 
 
 @app.get("/hobbies")
 async def serve_hobbies():
-    return FileResponse("views/hobbies.html")
+    return FileResponse("views/hobbies.html", media_type="text/html")
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+ThumbHash placeholders and responsive srcsets for gallery thumbnails.
+Encodes a ~25 byte hash per image and inlines it into pages as a tiny blurred
+background image, shown until the real thumbnail loads, and lists each
+thumbnail's width variants so browsers fetch the smallest one that fits.
+ThumbHash is a port of the reference algorithm by Evan Wallace (MIT).
+"""
+
+import base64
+import glob
+import re
+from io import BytesIO
+from math import ceil, cos, floor, pi
+from pathlib import Path
+from urllib.parse import quote, unquote
+from PIL import Image
+
+from analyze_images import read_dims
+
+# Thumbnail directory holding the <stem>.thumbhash files
+THUMBNAILS_DIR = Path("assets/thumbnails")
+
+# Pages whose thumbnail <img> tags get inline placeholders and srcsets
+PLACEHOLDER_PAGES = [Path("photography.html")]
+
+# Largest input the encoder accepts on either side
+MAX_HASH_INPUT = 100
+
+# Gallery grid from photography.html: 4 columns in at most 900px with 2px
+# gaps, rows 1.36x shorter than a column is wide
+GALLERY_WIDTH = 900
+GALLERY_COLUMNS = 4
+GALLERY_GAP = 2
+GALLERY_ROW_ASPECT = 1.36
+
+# Card class -> (columns, rows) spanned; plain cards take a single cell
+CARD_SPANS = {
+    "wide": (2, 1),
+    "tall": (1, 2),
+    "large": (2, 2),
+    "tall-xl": (2, 4),
+    "large-lg": (3, 3),
+}
+
+IMG_TAG = re.compile(r"<img\b[^>]*>")
+THUMBNAIL_SRC = re.compile(r'(?P<indent>\s+)src="(?P<dir>/?assets/thumbnails/)(?P<name>[^"]+)\.jpg"')
+PLACEHOLDER_STYLE = re.compile(r'\s*style="background-image: url\(data:image/png;base64,[^"]*"')
+SRCSET_ATTRS = re.compile(r'\s*(?:srcset|sizes)="[^"]*"')
+CARD_IMG = re.compile(r'<div\b[^>]*\bclass="(?P<classes>[^"]*\bphoto-card\b[^"]*)"[^>]*>\s*(?=<img\b)')
+
+
+def _round(value):
+    """Round half up, matching JavaScript's Math.round."""
+    return int(floor(value + 0.5))
+
+
+def _encode_channel(channel, w, h, nx, ny):
+    """DCT-encode one channel, returning (dc, normalized ac terms, scale)."""
+    dc, ac, scale = 0, [], 0
+    for cy in range(ny):
+        fy = [cos(pi / h * cy * (y + 0.5)) for y in range(h)]
+        cx = 0
+        while cx * ny < nx * (ny - cy):
+            fx = [cos(pi / w * cx * (x + 0.5)) for x in range(w)]
+            f = 0
+            for y in range(h):
+                row = y * w
+                f += fy[y] * sum(channel[row + x] * fx[x] for x in range(w))
+            f /= w * h
+            if cx or cy:
+                ac.append(f)
+                scale = max(scale, abs(f))
+            else:
+                dc = f
+            cx += 1
+    if scale:
+        ac = [0.5 + 0.5 / scale * f for f in ac]
+    return dc, ac, scale
+
+
+def rgba_to_thumbhash(w, h, rgba):
+    """Encode w x h RGBA bytes (each side at most 100px) as a ThumbHash."""
+    if w > MAX_HASH_INPUT or h > MAX_HASH_INPUT:
+        raise ValueError(f"{w}x{h} doesn't fit in {MAX_HASH_INPUT}x{MAX_HASH_INPUT}")
+
+    # Average color, weighted by alpha
+    avg_r = avg_g = avg_b = avg_a = 0
+    for j in range(0, w * h * 4, 4):
+        alpha = rgba[j + 3] / 255
+        avg_r += alpha / 255 * rgba[j]
+        avg_g += alpha / 255 * rgba[j + 1]
+        avg_b += alpha / 255 * rgba[j + 2]
+        avg_a += alpha
+    if avg_a:
+        avg_r /= avg_a
+        avg_g /= avg_a
+        avg_b /= avg_a
+
+    has_alpha = avg_a < w * h
+    l_limit = 5 if has_alpha else 7
+    lx = max(1, _round(l_limit * w / max(w, h)))
+    ly = max(1, _round(l_limit * h / max(w, h)))
+
+    # Convert to LPQA, compositing transparent pixels over the average color
+    l, p, q, a = [], [], [], []
+    for j in range(0, w * h * 4, 4):
+        alpha = rgba[j + 3] / 255
+        r = avg_r * (1 - alpha) + alpha / 255 * rgba[j]
+        g = avg_g * (1 - alpha) + alpha / 255 * rgba[j + 1]
+        b = avg_b * (1 - alpha) + alpha / 255 * rgba[j + 2]
+        l.append((r + g + b) / 3)
+        p.append((r + g) / 2 - b)
+        q.append(r - g)
+        a.append(alpha)
+
+    l_dc, l_ac, l_scale = _encode_channel(l, w, h, max(3, lx), max(3, ly))
+    p_dc, p_ac, p_scale = _encode_channel(p, w, h, 3, 3)
+    q_dc, q_ac, q_scale = _encode_channel(q, w, h, 3, 3)
+    if has_alpha:
+        a_dc, a_ac, a_scale = _encode_channel(a, w, h, 5, 5)
+
+    is_landscape = w > h
+    header24 = (
+        _round(63 * l_dc)
+        | (_round(31.5 + 31.5 * p_dc) << 6)
+        | (_round(31.5 + 31.5 * q_dc) << 12)
+        | (_round(31 * l_scale) << 18)
+        | (has_alpha << 23)
+    )
+    header16 = (
+        (ly if is_landscape else lx)
+        | (_round(63 * p_scale) << 3)
+        | (_round(63 * q_scale) << 9)
+        | (is_landscape << 15)
+    )
+    hash_bytes = [
+        header24 & 255, (header24 >> 8) & 255, header24 >> 16,
+        header16 & 255, header16 >> 8,
+    ]
+    if has_alpha:
+        hash_bytes.append(_round(15 * a_dc) | (_round(15 * a_scale) << 4))
+
+    # Pack the AC terms as 4-bit nibbles
+    ac_start = len(hash_bytes)
+    terms = l_ac + p_ac + q_ac + (a_ac if has_alpha else [])
+    hash_bytes.extend([0] * ((len(terms) + 1) // 2))
+    for index, f in enumerate(terms):
+        hash_bytes[ac_start + (index >> 1)] |= _round(15 * f) << ((index & 1) << 2)
+
+    return bytes(hash_bytes)
+
+
+def thumbhash_to_rgba(hash_bytes):
+    """Decode a ThumbHash into (w, h, rgba) at most 32px on the longer side."""
+    header24 = hash_bytes[0] | (hash_bytes[1] << 8) | (hash_bytes[2] << 16)
+    header16 = hash_bytes[3] | (hash_bytes[4] << 8)
+    l_dc = (header24 & 63) / 63
+    p_dc = ((header24 >> 6) & 63) / 31.5 - 1
+    q_dc = ((header24 >> 12) & 63) / 31.5 - 1
+    l_scale = ((header24 >> 18) & 31) / 31
+    has_alpha = bool(header24 >> 23)
+    p_scale = ((header16 >> 3) & 63) / 63
+    q_scale = ((header16 >> 9) & 63) / 63
+    is_landscape = bool(header16 >> 15)
+    l_limit = 5 if has_alpha else 7
+    lx = max(3, l_limit if is_landscape else header16 & 7)
+    ly = max(3, header16 & 7 if is_landscape else l_limit)
+    a_dc = (hash_bytes[5] & 15) / 15 if has_alpha else 1
+    a_scale = (hash_bytes[5] >> 4) / 15
+
+    ac_start = 6 if has_alpha else 5
+    ac_index = 0
+
+    def decode_channel(nx, ny, scale):
+        nonlocal ac_index
+        ac = []
+        for cy in range(ny):
+            cx = 0 if cy else 1
+            while cx * ny < nx * (ny - cy):
+                nibble = hash_bytes[ac_start + (ac_index >> 1)] >> ((ac_index & 1) << 2)
+                ac.append(((nibble & 15) / 7.5 - 1) * scale)
+                ac_index += 1
+                cx += 1
+        return ac
+
+    l_ac = decode_channel(lx, ly, l_scale)
+    p_ac = decode_channel(3, 3, p_scale * 1.25)
+    q_ac = decode_channel(3, 3, q_scale * 1.25)
+    a_ac = decode_channel(5, 5, a_scale) if has_alpha else []
+
+    # Output size follows the approximate aspect ratio stored in the header
+    ratio = (l_limit if is_landscape else header16 & 7) / (header16 & 7 if is_landscape else l_limit)
+    w = _round(32 if ratio > 1 else 32 * ratio)
+    h = _round(32 / ratio if ratio > 1 else 32)
+
+    rgba = bytearray(w * h * 4)
+    i = 0
+    for y in range(h):
+        fy = [cos(pi / h * (y + 0.5) * cy) for cy in range(max(ly, 5 if has_alpha else 3))]
+        for x in range(w):
+            fx = [cos(pi / w * (x + 0.5) * cx) for cx in range(max(lx, 5 if has_alpha else 3))]
+            l, p, q, a = l_dc, p_dc, q_dc, a_dc
+
+            j = 0
+            for cy in range(ly):
+                cx = 0 if cy else 1
+                fy2 = fy[cy] * 2
+                while cx * ly < lx * (ly - cy):
+                    l += l_ac[j] * fx[cx] * fy2
+                    cx += 1
+                    j += 1
+
+            j = 0
+            for cy in range(3):
+                fy2 = fy[cy] * 2
+                for cx in range(0 if cy else 1, 3 - cy):
+                    f = fx[cx] * fy2
+                    p += p_ac[j] * f
+                    q += q_ac[j] * f
+                    j += 1
+
+            if has_alpha:
+                j = 0
+                for cy in range(5):
+                    fy2 = fy[cy] * 2
+                    for cx in range(0 if cy else 1, 5 - cy):
+                        a += a_ac[j] * fx[cx] * fy2
+                        j += 1
+
+            b = l - 2 / 3 * p
+            r = (3 * l - b + q) / 2
+            g = r - q
+            rgba[i] = int(max(0, 255 * min(1, r)))
+            rgba[i + 1] = int(max(0, 255 * min(1, g)))
+            rgba[i + 2] = int(max(0, 255 * min(1, b)))
+            rgba[i + 3] = int(max(0, 255 * min(1, a)))
+            i += 4
+
+    return w, h, bytes(rgba)
+
+
+def image_to_thumbhash(img):
+    """Downscale a Pillow image to fit the encoder and return its ThumbHash."""
+    small = img.convert("RGBA")
+    small.thumbnail((MAX_HASH_INPUT, MAX_HASH_INPUT), Image.Resampling.BILINEAR)
+    return rgba_to_thumbhash(small.width, small.height, small.tobytes())
+
+
+def thumbhash_to_data_url(hash_bytes):
+    """Render a ThumbHash as a base64 PNG data URL."""
+    w, h, rgba = thumbhash_to_rgba(hash_bytes)
+    output = BytesIO()
+    Image.frombytes("RGBA", (w, h), rgba).save(output, format="PNG", optimize=True)
+    return "data:image/png;base64," + base64.b64encode(output.getvalue()).decode("ascii")
+
+
+def inject_placeholders(page_path, thumbnails_dir=THUMBNAILS_DIR):
+    """
+    Add a ThumbHash background to every thumbnail <img> in page_path.
+    Rewrites placeholders from a previous run; returns the number of tags updated.
+    """
+    html = page_path.read_text(encoding="utf-8")
+    updated = 0
+
+    def replace_tag(match):
+        nonlocal updated
+        tag = PLACEHOLDER_STYLE.sub("", match.group(0))
+        src = THUMBNAIL_SRC.search(tag)
+        if not src:
+            return tag
+
+        hash_path = thumbnails_dir / f"{unquote(src.group('name'))}.thumbhash"
+        if not hash_path.exists():
+            return tag
+
+        data_url = thumbhash_to_data_url(base64.b64decode(hash_path.read_text()))
+        style = (
+            f'{src.group("indent")}style="background-image: url({data_url}); '
+            'background-size: cover"'
+        )
+        updated += 1
+        return tag[:src.end()] + style + tag[src.end():]
+
+    new_html = IMG_TAG.sub(replace_tag, html)
+    if new_html != html:
+        page_path.write_text(new_html, encoding="utf-8")
+    return updated
+
+
+def _srcset_candidates(stem, thumbnails_dir):
+    """Return (width, filename) for the thumbnail and its <stem>-<w>w variants."""
+    candidates = []
+    base = thumbnails_dir / f"{stem}.jpg"
+    if base.exists():
+        candidates.append((read_dims(base)[0], base.name))
+
+    variant_name = re.compile(re.escape(stem) + r"-(\d+)w\.jpg")
+    for variant in thumbnails_dir.glob(f"{glob.escape(stem)}-*w.jpg"):
+        match = variant_name.fullmatch(variant.name)
+        if match:
+            candidates.append((int(match.group(1)), variant.name))
+
+    return sorted(candidates)
+
+
+def card_sizes(classes, aspect):
+    """
+    Return the sizes attribute for an image of the given width/height aspect
+    in a gallery card with the given classes. Cards use object-fit: cover, so
+    on the desktop grid the image is as wide as the wider of the slot and the
+    slot height scaled by its aspect.
+    """
+    spans = [CARD_SPANS[name] for name in classes.split() if name in CARD_SPANS]
+    columns, rows = max(spans, key=lambda span: span[0] * span[1], default=(1, 1))
+
+    column_width = (GALLERY_WIDTH - (GALLERY_COLUMNS - 1) * GALLERY_GAP) / GALLERY_COLUMNS
+    row_height = column_width / GALLERY_ROW_ASPECT
+    slot_width = columns * column_width + (columns - 1) * GALLERY_GAP
+    slot_height = rows * row_height + (rows - 1) * GALLERY_GAP
+    desktop_width = ceil(max(slot_width, slot_height * aspect))
+
+    # One column on phones; two columns up to 900px, where wide cards fill the row
+    tablet_width = "100vw" if columns >= 2 else "50vw"
+    return f"(max-width: 600px) 100vw, (max-width: 900px) {tablet_width}, {desktop_width}px"
+
+
+def inject_srcset(page_path, thumbnails_dir=THUMBNAILS_DIR):
+    """
+    Add srcset and sizes to every thumbnail <img> in page_path that has width
+    variants, with sizes fitted to the enclosing gallery card. Rewrites
+    srcsets from a previous run; returns the number updated.
+    """
+    html = page_path.read_text(encoding="utf-8")
+    updated = 0
+
+    # Card classes keyed by the offset of the <img> each card wraps
+    card_classes = {card.end(): card.group("classes") for card in CARD_IMG.finditer(html)}
+
+    def replace_tag(match):
+        nonlocal updated
+        tag = SRCSET_ATTRS.sub("", match.group(0))
+        src = THUMBNAIL_SRC.search(tag)
+        if not src:
+            return tag
+
+        candidates = _srcset_candidates(unquote(src.group("name")), thumbnails_dir)
+        if len(candidates) < 2:
+            return tag
+
+        width, height = read_dims(thumbnails_dir / candidates[-1][1])
+        sizes = card_sizes(card_classes.get(match.start(), ""), width / height)
+
+        # URLs in srcset are space and comma separated, so they must be quoted
+        srcset = ", ".join(
+            f"{src.group('dir')}{quote(name)} {width}w" for width, name in candidates
+        )
+        indent = src.group("indent")
+        attrs = f'{indent}srcset="{srcset}"{indent}sizes="{sizes}"'
+        updated += 1
+        return tag[:src.end()] + attrs + tag[src.end():]
+
+    new_html = IMG_TAG.sub(replace_tag, html)
+    if new_html != html:
+        page_path.write_text(new_html, encoding="utf-8")
+    return updated
+
+
+if __name__ == "__main__":
+    for page in PLACEHOLDER_PAGES:
+        print(f"{page}: {inject_placeholders(page)} placeholders, {inject_srcset(page)} srcsets")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Precompress static text assets in styles/ and scripts/.
+Writes <name>.gz (and <name>.br when brotli is installed) next to each file,
+so the server can send the encoded copy without compressing per request.
+"""
+
+import gzip
+import os
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Directories holding text assets
+ASSET_DIRS = [Path("styles"), Path("scripts")]
+
+# Extensions worth compressing
+TEXT_EXTENSIONS = {".css", ".js", ".mjs", ".map", ".svg", ".json", ".txt"}
+
+
+def precompress_file(path):
+    """Write the compressed siblings of path and return their sizes by suffix."""
+    data = path.read_bytes()
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+
+    sizes = {}
+    for suffix, encoded in variants.items():
+        # Only keep the variant if it actually saves bytes
+        target = path.with_name(path.name + suffix)
+        if len(encoded) < len(data):
+            target.write_bytes(encoded)
+            sizes[suffix] = len(encoded)
+        elif target.exists():
+            target.unlink()
+    return sizes
+
+
+def precompress():
+    """Precompress every text asset in ASSET_DIRS."""
+    if brotli is None:
+        print("brotli not installed, writing gzip only\n")
+
+    for asset_dir in ASSET_DIRS:
+        if not asset_dir.exists():
+            continue
+
+        for root, _, files in os.walk(asset_dir):
+            for name in sorted(files):
+                path = Path(root) / name
+                if path.suffix.lower() not in TEXT_EXTENSIONS:
+                    continue
+
+                sizes = precompress_file(path)
+                summary = ", ".join(
+                    f"{suffix} {size / 1024:.1f}KB" for suffix, size in sizes.items()
+                )
+                print(f"✓ {path}: {path.stat().st_size / 1024:.1f}KB → {summary or 'skipped'}")
+
+
+if __name__ == "__main__":
+    precompress()